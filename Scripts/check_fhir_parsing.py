@@ -0,0 +1,67 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # repo root, for ingest_fhir
+from ingest_fhir import ingest_bundle
+from validate_and_build import as_utc
+
+# Valid FHIR shapes the sample bundle doesn't cover: empty arrays, and nested
+# fields that only some resources carry. ingest_bundle must parse them all.
+
+
+def bundle(*resources):
+    return {"resourceType": "Bundle", "entry": [{"resource": r} for r in resources]}
+
+
+encounter = {"resourceType": "Encounter", "id": "enc-1", "subject": {"reference": "Patient/pat-1"}}
+
+cases = {
+    "every Patient has identifier: []": bundle(
+        {"resourceType": "Patient", "id": "pat-1", "identifier": []},
+        {"resourceType": "Patient", "id": "pat-2", "identifier": []},
+        encounter,
+    ),
+    "every Observation has code.coding: []": bundle(
+        {"resourceType": "Patient", "id": "pat-1"},
+        encounter,
+        {"resourceType": "Observation", "id": "obs-1", "code": {"coding": []}},
+        {"resourceType": "Observation", "id": "obs-2", "code": {"coding": []}},
+    ),
+    "name without given/family next to no name": bundle(
+        {"resourceType": "Patient", "id": "pat-1", "name": [{"text": "A"}]},
+        {"resourceType": "Patient", "id": "pat-2"},
+        encounter,
+    ),
+}
+
+for label, b in cases.items():
+    df_pat, df_enc, df_obs, df_chg = ingest_bundle(b)
+    if label.startswith("every Patient"):
+        assert df_pat["mrn"].isna().all()
+    if label.startswith("every Observation"):
+        assert df_obs["loinc_code"].isna().all()
+    if label.startswith("name"):
+        assert df_pat["name"].iloc[0] == "" and df_pat["name"].isna().iloc[1]
+    print(f"ok: {label}")
+
+df_pat, *_ = ingest_bundle(
+    bundle({"resourceType": "Patient", "id": "pat-1", "name": [{"given": ["Ann", "B"], "family": "Cole"}]}, encounter)
+)
+assert df_pat["name"].iloc[0] == "Ann B Cole"
+
+# dateTimes of mixed ISO 8601 shapes in one column (Z vs offset, fractional
+# seconds, date-only) must parse together
+_, df_enc, *_ = ingest_bundle(
+    bundle(
+        {"resourceType": "Patient", "id": "pat-1"},
+        {**encounter, "period": {"start": "2024-01-05T08:00:00Z", "end": "2024-01-05T08:00:00.123-05:00"}},
+        {**encounter, "id": "enc-2", "period": {"start": "2024-01-06", "end": "2024-01-07T10:30:00+01:00"}},
+    )
+)
+admit, discharge = as_utc(df_enc["start_ts"]), as_utc(df_enc["end_ts"])
+assert str(admit.iloc[0]) == "2024-01-05 08:00:00+00:00"
+assert str(discharge.iloc[0]) == "2024-01-05 13:00:00.123000+00:00"
+assert str(admit.iloc[1]) == "2024-01-06 00:00:00+00:00"
+print("ok: mixed ISO 8601 dateTimes")
+
+print("FHIR parsing checks passed.")
@@ -1,12 +1,16 @@
-import os
+import sys
+from pathlib import Path
+
 import pandas as pd
-from dotenv import load_dotenv
-from sqlalchemy import create_engine
 
-load_dotenv() 
-engine = create_engine(os.getenv("DATABASE_URL"), future=True)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # repo root, for etl_common
+from etl_common import get_engine
+
+engine = get_engine()
 
-for t in ["stg_fhir_patient", "stg_fhir_encounter", "stg_fhir_observation", "stg_fhir_chargeitem"]:
-    df = pd.read_sql(f"SELECT * FROM {t} LIMIT 20", engine) 
-    print("\n==", t, "==")
-    print(df)
+# One connection for all four previews instead of a pool checkout per table
+with engine.connect() as conn:
+    for t in ["stg_fhir_patient", "stg_fhir_encounter", "stg_fhir_observation", "stg_fhir_chargeitem"]:
+        df = pd.read_sql(f"SELECT * FROM {t} LIMIT 20", conn) 
+        print("\n==", t, "==")
+        print(df)
@@ -1,14 +1,12 @@
-import os
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
+import sys
+from pathlib import Path
 
-load_dotenv()
-db_url = os.getenv("DATABASE_URL") 
- 
-if not db_url:
-    raise RuntimeError("DATABASE_URL not set") 
+from sqlalchemy import text
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # repo root, for etl_common
+from etl_common import get_engine
 
-engine = create_engine(db_url, future=True)  
+engine = get_engine()
  
 with engine.connect() as conn:
     result = conn.execute(text("SELECT current_database(), current_user, now();")).first()  
@@ -1,9 +1,8 @@
-import os
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 
-load_dotenv()
-engine = create_engine(os.getenv("DATABASE_URL"), future=True)
+from etl_common import get_engine
+
+engine = get_engine()
 
 SCHEMA_SQL = """
 CREATE TABLE IF NOT EXISTS etl_run_log (
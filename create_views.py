@@ -1,18 +1,12 @@
-import os
 from pathlib import Path
 
-from dotenv import load_dotenv 
-from sqlalchemy import create_engine, text 
+from sqlalchemy import text 
 
+from etl_common import get_engine
 
-def main():
-    load_dotenv()
 
-    db_url = os.getenv("DATABASE_URL") 
-    if not db_url:
-        raise RuntimeError("DATABASE_URL not found in environment")
- 
-    engine = create_engine(db_url, future=True) 
+def main():
+    engine = get_engine()
 
     sql_path = Path("sql/views.sql") 
     if not sql_path.exists():
@@ -24,7 +18,7 @@ def main():
         # Execute entire SQL file 
         conn.execute(text(sql))
  
-    print("Reporting views created or replaced successfully.") 
+    print("Reporting views created successfully (validate_and_build.py refreshes them).") 
 
 
 if __name__ == "__main__":
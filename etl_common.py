@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import io
+import os
+
+import pandas as pd
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, make_url
+from sqlalchemy.engine import Connection, Engine
+
+
+def database_url() -> str:
+    load_dotenv()
+    db_url = os.getenv("DATABASE_URL")
+    if not db_url:
+        raise RuntimeError("DATABASE_URL not found. Ensure you have a .env file with DATABASE_URL=...")
+    return db_url
+
+
+def libpq_url() -> str:
+    """
+    DATABASE_URL without the SQLAlchemy driver suffix, for clients that talk libpq directly.
+    Example: postgresql+psycopg2://u:p@host/db -> postgresql://u:p@host/db
+    """
+    return make_url(database_url()).set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+def get_engine() -> Engine:
+    """
+    Engine shared by every pipeline script. These are one-shot scripts, so a
+    single pooled connection (checked before use) is enough; executemany calls
+    are batched (multi-row INSERT ... VALUES, psycopg2 execute_batch).
+    """
+    return create_engine(
+        database_url(),
+        future=True,
+        pool_size=1,
+        pool_pre_ping=True,
+        executemany_mode="values_plus_batch",
+        insertmanyvalues_page_size=10000,
+        executemany_batch_page_size=1000,
+    )
+
+
+def read_sql(query: str) -> pd.DataFrame:
+    """
+    Run a SELECT with connectorx, which decodes rows in Rust straight into
+    column buffers instead of building Python row tuples like pd.read_sql.
+    """
+    # Imported here so scripts that only need get_engine() don't need connectorx
+    import connectorx as cx
+
+    return cx.read_sql(libpq_url(), query, return_type="pandas")
+
+
+def copy_from_df(conn: Connection, table: str, df: pd.DataFrame, batch_rows: int = 50_000) -> None:
+    """
+    Append a DataFrame to an existing table with COPY ... FROM STDIN.
+    Columns are matched by name; NaN/None are written as empty fields (NULL).
+    Rows are sent `batch_rows` at a time, so only one batch of CSV text is in
+    memory at once.
+    """
+    columns = ", ".join(f'"{c}"' for c in df.columns)
+    sql = f"COPY {table} ({columns}) FROM STDIN WITH CSV"
+
+    buf = io.StringIO()
+    with conn.connection.cursor() as cur:
+        for start in range(0, len(df), batch_rows):
+            buf.seek(0)
+            buf.truncate()
+            df.iloc[start : start + batch_rows].to_csv(buf, index=False, header=False)
+            buf.seek(0)
+            cur.copy_expert(sql, buf)
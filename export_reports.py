@@ -1,22 +1,24 @@
-import os
 from pathlib import Path
 
-import pandas as pd
-from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from etl_common import get_engine
 
-load_dotenv()
-engine = create_engine(os.getenv("DATABASE_URL"), future=True)
+engine = get_engine()
 
 out = Path("output/reports")
 out.mkdir(parents=True, exist_ok=True)
 
 reports = {
-    "encounters_by_department_month.csv": "SELECT * FROM public.vw_encounters_by_department_month",
-    "avg_los_by_encounter_type.csv": "SELECT * FROM public.vw_avg_los_by_encounter_type",
+    "encounters_by_department_month.csv": "SELECT * FROM public.mv_encounters_by_department_month",
+    "avg_los_by_encounter_type.csv": "SELECT * FROM public.mv_avg_los_by_encounter_type",
 }
 
-for fname, sql in reports.items():
-    df = pd.read_sql(sql, engine)
-    df.to_csv(out / fname, index=False)
-    print(f"Wrote {fname} ({len(df)} rows)")
+# Stream each report straight from the server into its file (no DataFrame in between)
+raw = engine.raw_connection()
+try:
+    with raw.cursor() as cur:
+        for fname, sql in reports.items():
+            with open(out / fname, "w", encoding="utf-8", newline="") as f:
+                cur.copy_expert(f"COPY ({sql}) TO STDOUT WITH CSV HEADER", f)
+            print(f"Wrote {fname} ({cur.rowcount} rows)")
+finally:
+    raw.close()
@@ -1,18 +1,22 @@
 from __future__ import annotations
 
-import random
 from pathlib import Path
 from datetime import datetime, timedelta, timezone
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 
 
-def rchoice(rng: random.Random, items):
-    return items[rng.randrange(len(items))]
+def make_ids(prefix: str, n: int, width: int) -> np.ndarray:
+    """Sequential ids 1..n, e.g. make_ids("PAT", 3, 5) -> PAT00001, PAT00002, PAT00003."""
+    return (prefix + pd.Series(np.arange(1, n + 1)).astype(str).str.zfill(width)).to_numpy()
 
 
 def main(seed: int = 42, n_patients: int = 250, n_encounters: int = 1200) -> None:
-    rng = random.Random(seed)
+    rng = np.random.default_rng(seed)
 
     out_dir = Path("data/raw")
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -27,152 +31,149 @@ def main(seed: int = 42, n_patients: int = 250, n_encounters: int = 1200) -> Non
         ("OB", "OB/GYN"),
         ("PT", "Physical Therapy"),
     ]
+    dept_ids = np.array([d for d, _ in departments])
 
-    encounter_types = ["ED", "Inpatient", "Outpatient", "Observation"]
+    encounter_types = np.array(["ED", "Inpatient", "Outpatient", "Observation"])
 
-    providers = []
-    for i in range(1, 41):
-        dept_id, _ = rchoice(rng, departments)
-        providers.append((f"PRV{i:04d}", f"Provider {i:02d}", dept_id))
+    n_providers = 40
+    provider_ids = make_ids("PRV", n_providers, 4)
+    provider_depts = dept_ids[rng.integers(0, len(dept_ids), n_providers)]
 
     # --- Patients ---
-    patients = []
-    for i in range(1, n_patients + 1):
-        patient_id = f"PAT{i:05d}"
-        birth_year = rng.randint(1935, 2020)
-        sex = rchoice(rng, ["F", "M"])
-        patients.append((patient_id, birth_year, sex))
-    df_patients = pd.DataFrame(patients, columns=["patient_id", "birth_year", "sex"])
+    df_patients = pd.DataFrame(
+        {
+            "patient_id": make_ids("PAT", n_patients, 5),
+            "birth_year": rng.integers(1935, 2021, n_patients),
+            "sex": rng.choice(["F", "M"], n_patients),
+        }
+    )
 
     # --- Encounters ---
     # Generate encounters over last ~18 months
     now = datetime.now(timezone.utc)
     start = now - timedelta(days=540)
 
-    enc_rows = []
-    for i in range(1, n_encounters + 1):
-        encounter_id = f"ENC{i:06d}"
-        patient_id, _, _ = rchoice(rng, patients)
-
-        provider_id, _, dept_id = rchoice(rng, providers) 
-        etype = rchoice(rng, encounter_types)
-
-        admit_ts = start + timedelta(minutes=rng.randint(0, 540 * 24 * 60))
+    patient_idx = rng.integers(0, n_patients, n_encounters)
+    prov_idx = rng.integers(0, n_providers, n_encounters)
+    etype = encounter_types[rng.integers(0, len(encounter_types), n_encounters)]
 
-        # LOS distribution by type 
-        if etype == "Inpatient":
-            los_hours = rng.randint(24, 24 * 10)
-        elif etype == "Observation": 
-            los_hours = rng.randint(8, 36)
-        elif etype == "ED":
-            los_hours = rng.randint(1, 12)
-        else:
-            los_hours = rng.randint(1, 6)
+    admit_ts = pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, 540 * 24 * 60 + 1, n_encounters), unit="m")
 
-        discharge_ts = admit_ts + timedelta(hours=los_hours)
+    # LOS distribution by type
+    los_hours = np.select(
+        [etype == "Inpatient", etype == "Observation", etype == "ED"],
+        [
+            rng.integers(24, 24 * 10 + 1, n_encounters),
+            rng.integers(8, 37, n_encounters),
+            rng.integers(1, 13, n_encounters),
+        ],
+        default=rng.integers(1, 7, n_encounters),
+    )
 
-        enc_rows.append(
-            (encounter_id, patient_id, provider_id, dept_id, admit_ts.isoformat(), discharge_ts.isoformat(), etype)
-        )
+    discharge_ts = admit_ts + pd.to_timedelta(los_hours, unit="h")
 
     df_enc = pd.DataFrame(
-        enc_rows,
-        columns=[
-            "encounter_id",
-            "patient_id", 
-            "provider_id",
-            "department_id",
-            "admit_ts", 
-            "discharge_ts",
-            "encounter_type", 
-        ],
+        {
+            "encounter_id": make_ids("ENC", n_encounters, 6),
+            "patient_id": df_patients["patient_id"].to_numpy()[patient_idx],
+            "provider_id": provider_ids[prov_idx],
+            "department_id": provider_depts[prov_idx],
+            "admit_ts": admit_ts,
+            "discharge_ts": discharge_ts,
+            "encounter_type": etype,
+        }
     )
 
     # --- Charges (financial-ish) ---
     cpt_codes = ["99283", "99284", "99285", "93000", "80053", "85025", "71045", "74177", "36415"]
-    charge_rows = []
-    charge_id_counter = 1
-    for _, row in df_enc.iterrows():
-        # number of charge lines
-        n_lines = rng.randint(1, 8)
-        base_ts = datetime.fromisoformat(row["admit_ts"])
-        for _ in range(n_lines):
-            charge_id = f"CHG{charge_id_counter:08d}"
-            charge_id_counter += 1
-            cpt = rchoice(rng, cpt_codes) 
-            # amounts: skewed positive; keep realistic-ish
-            amount = round(max(5.0, rng.lognormvariate(6.2, 0.6)), 2) 
-            posted_ts = base_ts + timedelta(hours=rng.randint(0, 48)) 
-            charge_rows.append((charge_id, row["encounter_id"], cpt, amount, posted_ts.isoformat())) 
-
-    df_chg = pd.DataFrame(charge_rows, columns=["charge_id", "encounter_id", "cpt_code", "amount", "posted_ts"])
+
+    # number of charge lines per encounter; repeat each encounter row once per line
+    n_lines = rng.integers(1, 9, n_encounters)
+    n_charges = int(n_lines.sum())
+    chg_rows = df_enc.loc[df_enc.index.repeat(n_lines), ["encounter_id", "admit_ts"]].reset_index(drop=True)
+
+    df_chg = pd.DataFrame(
+        {
+            "charge_id": make_ids("CHG", n_charges, 8),
+            "encounter_id": chg_rows["encounter_id"],
+            "cpt_code": rng.choice(cpt_codes, n_charges),
+            # amounts: skewed positive; keep realistic-ish. Stored as integer cents
+            # (min $5.00) so the extract carries no float formatting noise.
+            "amount_cents": np.maximum(500, (rng.lognormal(6.2, 0.6, n_charges) * 100).round().astype(np.int64)),
+            "posted_ts": chg_rows["admit_ts"] + pd.to_timedelta(rng.integers(0, 49, n_charges), unit="h"),
+        }
+    )
 
     # --- Labs (clinical-ish) ---
+    # (code, name, unit, low, high, decimals): crude uniform value range per test
     loinc = [
-        ("718-7", "Hemoglobin", "g/dL"),  
-        ("4548-4", "Hematocrit", "%"), 
-        ("6690-2", "WBC", "10^3/uL"), 
-        ("2951-2", "Sodium", "mmol/L"), 
-        ("2823-3", "Potassium", "mmol/L"),
-        ("2075-0", "Chloride", "mmol/L"), 
-        ("2160-0", "Creatinine", "mg/dL"), 
+        ("718-7", "Hemoglobin", "g/dL", 10.0, 17.5, 1),  
+        ("4548-4", "Hematocrit", "%", 30.0, 52.0, 1), 
+        ("6690-2", "WBC", "10^3/uL", 3.5, 17.0, 1), 
+        ("2951-2", "Sodium", "mmol/L", 130.0, 150.0, 1), 
+        ("2823-3", "Potassium", "mmol/L", 3.0, 5.8, 1),
+        ("2075-0", "Chloride", "mmol/L", 95.0, 110.0, 1), 
+        ("2160-0", "Creatinine", "mg/dL", 0.5, 2.2, 2), 
     ]
-    lab_rows = []
-    lab_id_counter = 1
-    for _, row in df_enc.iterrows():
-        # not every encounter has labs
-        if rng.random() < 0.55:
-            n_labs = rng.randint(1, 6)
-            base_ts = datetime.fromisoformat(row["admit_ts"])
-            for _ in range(n_labs):
-                lab_id = f"LAB{lab_id_counter:08d}"
-                lab_id_counter += 1
-                loinc_code, _, unit = rchoice(rng, loinc)
-
-                # crude value generation by test
-                if loinc_code == "718-7":
-                    val = round(rng.uniform(10.0, 17.5), 1)
-                elif loinc_code == "4548-4":
-                    val = round(rng.uniform(30.0, 52.0), 1)
-                elif loinc_code == "6690-2":
-                    val = round(rng.uniform(3.5, 17.0), 1)
-                elif loinc_code == "2951-2":
-                    val = round(rng.uniform(130.0, 150.0), 1)
-                elif loinc_code == "2823-3":
-                    val = round(rng.uniform(3.0, 5.8), 1)
-                elif loinc_code == "2075-0":
-                    val = round(rng.uniform(95.0, 110.0), 1)
-                else:  # creatinine
-                    val = round(rng.uniform(0.5, 2.2), 2)
-
-                result_ts = base_ts + timedelta(hours=rng.randint(1, 24))
-                lab_rows.append((lab_id, row["encounter_id"], loinc_code, val, unit, result_ts.isoformat()))
+    loinc_codes = np.array([row[0] for row in loinc])
+    loinc_units = np.array([row[2] for row in loinc])
+    loinc_lo = np.array([row[3] for row in loinc])
+    loinc_hi = np.array([row[4] for row in loinc])
+    loinc_prec = np.array([row[5] for row in loinc])
+
+    # not every encounter has labs; repeat each encounter row once per lab
+    n_labs = np.where(rng.random(n_encounters) < 0.55, rng.integers(1, 7, n_encounters), 0)
+    total_labs = int(n_labs.sum())
+    lab_rows = df_enc.loc[df_enc.index.repeat(n_labs), ["encounter_id", "admit_ts"]].reset_index(drop=True)
+
+    loinc_idx = rng.integers(0, len(loinc), total_labs)
+    codes = loinc_codes[loinc_idx]
+
+    # one draw per lab from that test's range, then round to the test's precision
+    values = rng.uniform(loinc_lo[loinc_idx], loinc_hi[loinc_idx])
+    values = np.where(loinc_prec[loinc_idx] == 1, values.round(1), values.round(2))
 
     df_lab = pd.DataFrame(
-        lab_rows, columns=["lab_id", "encounter_id", "loinc_code", "result_value", "unit", "result_ts"]
+        {
+            "lab_id": make_ids("LAB", total_labs, 8),
+            "encounter_id": lab_rows["encounter_id"],
+            "loinc_code": codes,
+            "result_value": values,
+            "unit": loinc_units[loinc_idx],
+            "result_ts": lab_rows["admit_ts"] + pd.to_timedelta(rng.integers(1, 25, total_labs), unit="h"),
+        }
     )
 
     # --- Staff (HR-ish) ---
     roles = ["RN", "MD", "PA", "NP", "Tech", "Admin"]
-    staff_rows = []
-    for i in range(1, 61):
-        staff_id = f"STF{i:05d}" 
-        provider_id, _, _ = rchoice(rng, providers) 
-        role = rchoice(rng, roles) 
-        hire_date = (now - timedelta(days=rng.randint(30, 3650))).date().isoformat() 
-        staff_rows.append((staff_id, provider_id, role, hire_date)) 
-    df_staff = pd.DataFrame(staff_rows, columns=["staff_id", "provider_id", "role", "hire_date"])
+    n_staff = 60
+    hire_dates = pd.Timestamp(now) - pd.to_timedelta(rng.integers(30, 3651, n_staff), unit="D")
+    df_staff = pd.DataFrame(
+        {
+            "staff_id": make_ids("STF", n_staff, 5),
+            "provider_id": provider_ids[rng.integers(0, n_providers, n_staff)],
+            "role": rng.choice(roles, n_staff),
+            "hire_date": hire_dates.date,
+        }
+    )
 
     # --- Save ---
-    df_enc.to_csv(out_dir / "encounters.csv", index=False)
-    df_chg.to_csv(out_dir / "charges.csv", index=False)
-    df_lab.to_csv(out_dir / "labs.csv", index=False)
-    df_staff.to_csv(out_dir / "staff.csv", index=False)
-    df_patients.to_csv(out_dir / "patients.csv", index=False)
+    # CSV is the extract format; the Parquet sibling lets load_staging.py skip CSV parsing
+    outputs = {
+        "patients": df_patients,
+        "encounters": df_enc,
+        "charges": df_chg,
+        "labs": df_lab,
+        "staff": df_staff,
+    }
+    for name, df in outputs.items():
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        pacsv.write_csv(table, out_dir / f"{name}.csv")
+        pq.write_table(table, out_dir / f"{name}.parquet")
 
     print("Wrote:")
-    for p in ["patients.csv", "encounters.csv", "charges.csv", "labs.csv", "staff.csv"]:
-        print(" -", out_dir / p)
+    for name in outputs:
+        print(" -", out_dir / f"{name}.csv", f"(+ {name}.parquet)")
 
 
 if __name__ == "__main__":
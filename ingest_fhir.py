@@ -1,17 +1,40 @@
 from __future__ import annotations
 
-import json
-import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Tuple
 
+import orjson
 import pandas as pd
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
+
+from etl_common import copy_from_df, get_engine
 
 
 FHIR_DIR = Path("data/fhir")
 
+# Staging tables are rebuilt on every run, so they are UNLOGGED (no WAL, not crash-safe).
+# Timestamps and birth_date stay TEXT: FHIR allows partial dates ("2024", "2024-03")
+# and mixed dateTime shapes. validate_and_build.py parses timestamps as ISO 8601
+# (as_utc) and takes birth_year from the date's year prefix (year_of).
+FHIR_STAGING_COLUMNS = {
+    "stg_fhir_patient": "patient_id TEXT, mrn TEXT, name TEXT, gender TEXT, birth_date TEXT, source_file TEXT",
+    "stg_fhir_encounter": (
+        "encounter_id TEXT, patient_id TEXT, status TEXT, class_system TEXT, class_code TEXT, "
+        "class_display TEXT, start_ts TEXT, end_ts TEXT, department TEXT, provider_name TEXT, source_file TEXT"
+    ),
+    "stg_fhir_observation": (
+        "observation_id TEXT, patient_id TEXT, encounter_id TEXT, loinc_system TEXT, loinc_code TEXT, "
+        "loinc_display TEXT, effective_ts TEXT, value DOUBLE PRECISION, unit TEXT, source_file TEXT"
+    ),
+    "stg_fhir_chargeitem": (
+        "chargeitem_id TEXT, patient_id TEXT, encounter_id TEXT, cpt_system TEXT, cpt_code TEXT, "
+        "cpt_display TEXT, occurrence_ts TEXT, quantity DOUBLE PRECISION, amount DOUBLE PRECISION, "
+        "currency TEXT, source_file TEXT"
+    ),
+}
+
 
 def die(msg: str) -> None:
     raise RuntimeError(f"FHIR INGEST FAILED: {msg}")
@@ -19,41 +42,58 @@ def die(msg: str) -> None:
 
 def load_json(path: Path) -> Dict[str, Any]:
     try:
-        return json.loads(path.read_text(encoding="utf-8"))
+        return orjson.loads(path.read_bytes())
     except Exception as e:
         die(f"Could not parse JSON: {path} ({e})")
 
 
-def ref_id(ref: Optional[str]) -> Optional[str]:
+def column(df: pd.DataFrame, name: str) -> pd.Series:
     """
-    Convert 'Patient/patient-001' -> 'patient-001'
-    If ref is already an id-like string, return as-is.
+    Return a flattened column from pd.json_normalize output.
+    If no resource in the bucket carried that field, return an all-null column instead.
     """
-    if not ref:
-        return None
-    if "/" in ref:
-        return ref.split("/")[-1]
-    return ref
+    if name in df.columns:
+        return df[name]
+    return pd.Series(None, index=df.index, dtype=object)
 
 
-def coding_pick(resource: Dict[str, Any], coding_path: Tuple[str, ...]) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+def first_item(df: pd.DataFrame, name: str, *keys: str) -> pd.Series:
     """
-    Convenience: pull a (system, code, display) from nested coding arrays.
-    Example paths:
-      ("code", "coding") for Observation.code.coding
-      ("class",) for Encounter.class (not an array, handled separately below)
+    Take element [0] of a FHIR array column, then walk `keys` into it.
+    Missing or empty arrays and missing keys give None.
+    Example:
+      first_item(df, "code.coding", "code") for Observation.code.coding[0].code
     """
-    cur: Any = resource
-    for k in coding_path:
-        if not isinstance(cur, dict) or k not in cur:
-            return (None, None, None)
-        cur = cur[k]
+    # One map with dict.get rather than chained .str calls: once a step comes
+    # back all-NaN pandas makes the Series float64 and the next .str raises
+    def pick(items: Any) -> Any:
+        if not isinstance(items, list) or not items:
+            return None
+        out = items[0]
+        for k in keys:
+            if not isinstance(out, dict):
+                return None
+            out = out.get(k)
+        return out
+
+    return column(df, name).map(pick).astype(object)
+
+
+def full_name(name: Any) -> Any:
+    """HumanName -> "given1 given2 family" (None when the patient has no name)."""
+    if not isinstance(name, dict):
+        return None
+    given = " ".join(name.get("given") or [])
+    return " ".join(x for x in [given, name.get("family")] if x)
 
-    # cur should be a list of codings
-    if isinstance(cur, list) and len(cur) > 0 and isinstance(cur[0], dict):
-        c0 = cur[0]
-        return (c0.get("system"), c0.get("code"), c0.get("display"))
-    return (None, None, None)
+
+def ref_ids(refs: pd.Series) -> pd.Series:
+    """
+    Convert 'Patient/patient-001' -> 'patient-001' for a whole column.
+    Values that are already id-like strings are returned as-is.
+    """
+    # object cast: an all-null column can arrive as float64, which has no .str
+    return refs.astype(object).str.rsplit("/", n=1).str[-1]
 
 
 def ingest_bundle(bundle: Dict[str, Any]) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
@@ -64,149 +104,93 @@ def ingest_bundle(bundle: Dict[str, Any]) -> Tuple[pd.DataFrame, pd.DataFrame, p
     if not isinstance(entries, list) or len(entries) == 0:
         die("Bundle.entry is empty or invalid")
 
-    patients: List[Dict[str, Any]] = []
-    encounters: List[Dict[str, Any]] = []
-    observations: List[Dict[str, Any]] = []
-    chargeitems: List[Dict[str, Any]] = []
-
+    # One pass to bucket resources by type; everything after this works column-wise
+    by_type: Dict[Any, List[Dict[str, Any]]] = defaultdict(list)
     for ent in entries:
         res = (ent or {}).get("resource")
-        if not isinstance(res, dict):
-            continue
-
-        rtype = res.get("resourceType")
-        rid = res.get("id")
-
-        if rtype == "Patient":
-            ident = None
-            identifiers = res.get("identifier") or []
-            if isinstance(identifiers, list) and identifiers:
-                ident = identifiers[0].get("value")
-
-            name = None
-            names = res.get("name") or []
-            if isinstance(names, list) and names:
-                n0 = names[0]
-                given = " ".join(n0.get("given", []) or [])
-                family = n0.get("family")
-                name = " ".join([x for x in [given, family] if x])
-
-            patients.append(
-                {
-                    "patient_id": rid,
-                    "mrn": ident,
-                    "name": name,
-                    "gender": res.get("gender"),
-                    "birth_date": res.get("birthDate"),
-                }
-            )
-
-        elif rtype == "Encounter":
-            subj = ref_id((res.get("subject") or {}).get("reference"))
-            period = res.get("period") or {}
-            start = period.get("start")
-            end = period.get("end")
-
-            # Encounter.class is a single coding object (not array)
-            cls = res.get("class") or {}
-            class_system = cls.get("system")
-            class_code = cls.get("code")
-            class_display = cls.get("display")
-
-            # department-ish: we’ll store Encounter.location[0].location.display as department_name-ish
-            dept = None
-            loc = res.get("location") or []
-            if isinstance(loc, list) and loc:
-                l0 = loc[0].get("location") or {}
-                dept = l0.get("display")
-
-            # provider-ish: participant[0].individual.display
-            provider = None
-            part = res.get("participant") or []
-            if isinstance(part, list) and part:
-                p0 = part[0].get("individual") or {}
-                provider = p0.get("display")
-
-            encounters.append(
-                {
-                    "encounter_id": rid,
-                    "patient_id": subj,
-                    "status": res.get("status"),
-                    "class_system": class_system,
-                    "class_code": class_code,
-                    "class_display": class_display,
-                    "start_ts": start,
-                    "end_ts": end,
-                    "department": dept,
-                    "provider_name": provider,
-                }
-            )
-
-        elif rtype == "Observation":
-            subj = ref_id((res.get("subject") or {}).get("reference"))
-            enc = ref_id((res.get("encounter") or {}).get("reference"))
- 
-            (code_system, code_code, code_display) = coding_pick(res, ("code", "coding"))
-
-            eff = res.get("effectiveDateTime")
-            valq = res.get("valueQuantity") or {}
-            observations.append(
-                {
-                    "observation_id": rid,
-                    "patient_id": subj, 
-                    "encounter_id": enc,
-                    "loinc_system": code_system,
-                    "loinc_code": code_code,
-                    "loinc_display": code_display or (res.get("code") or {}).get("text"),
-                    "effective_ts": eff,
-                    "value": valq.get("value"),
-                    "unit": valq.get("unit"),
-                }
-            )
-
-        elif rtype == "ChargeItem": 
-            subj = ref_id((res.get("subject") or {}).get("reference"))
-            enc = ref_id((res.get("context") or {}).get("reference"))
-
-            (cpt_system, cpt_code, cpt_display) = coding_pick(res, ("code", "coding"))
-
-            occ = res.get("occurrenceDateTime")
-            price = (res.get("priceOverride") or {}).get("value")
-            currency = (res.get("priceOverride") or {}).get("currency") 
-            qty = (res.get("quantity") or {}).get("value")
-
-            chargeitems.append(
-                {
-                    "chargeitem_id": rid,
-                    "patient_id": subj,
-                    "encounter_id": enc,
-                    "cpt_system": cpt_system, 
-                    "cpt_code": cpt_code,
-                    "cpt_display": cpt_display or (res.get("code") or {}).get("text"),
-                    "occurrence_ts": occ,
-                    "quantity": qty,
-                    "amount": price,
-                    "currency": currency,
-                }
-            )
-
-        # ignore other resources for now (Practitioner, Organization, etc.)
-
-    df_pat = pd.DataFrame(patients)
-    df_enc = pd.DataFrame(encounters)
-    df_obs = pd.DataFrame(observations)
-    df_chg = pd.DataFrame(chargeitems) 
+        if isinstance(res, dict):
+            by_type[res.get("resourceType")].append(res)
+
+    # Nested objects flatten to dotted columns (e.g. "period.start"); arrays stay as lists
+    pat = pd.json_normalize(by_type["Patient"])
+    enc = pd.json_normalize(by_type["Encounter"])
+    obs = pd.json_normalize(by_type["Observation"])
+    chg = pd.json_normalize(by_type["ChargeItem"])
+    # ignore other resources for now (Practitioner, Organization, etc.)
+
+    df_pat = pd.DataFrame(
+        {
+            "patient_id": column(pat, "id"),
+            "mrn": first_item(pat, "identifier", "value"),
+            "name": first_item(pat, "name").map(full_name),
+            "gender": column(pat, "gender"),
+            "birth_date": column(pat, "birthDate"),
+        }
+    )
+
+    # Encounter.class is a single coding object (not array), so it flattens to class.*
+    # department-ish: Encounter.location[0].location.display
+    # provider-ish: participant[0].individual.display
+    df_enc = pd.DataFrame(
+        {
+            "encounter_id": column(enc, "id"),
+            "patient_id": ref_ids(column(enc, "subject.reference")),
+            "status": column(enc, "status"),
+            "class_system": column(enc, "class.system"),
+            "class_code": column(enc, "class.code"),
+            "class_display": column(enc, "class.display"),
+            "start_ts": column(enc, "period.start"),
+            "end_ts": column(enc, "period.end"),
+            "department": first_item(enc, "location", "location", "display"),
+            "provider_name": first_item(enc, "participant", "individual", "display"),
+        }
+    )
+
+    df_obs = pd.DataFrame(
+        {
+            "observation_id": column(obs, "id"),
+            "patient_id": ref_ids(column(obs, "subject.reference")),
+            "encounter_id": ref_ids(column(obs, "encounter.reference")),
+            "loinc_system": first_item(obs, "code.coding", "system"),
+            "loinc_code": first_item(obs, "code.coding", "code"),
+            "loinc_display": first_item(obs, "code.coding", "display").fillna(column(obs, "code.text")),
+            "effective_ts": column(obs, "effectiveDateTime"),
+            "value": column(obs, "valueQuantity.value"),
+            "unit": column(obs, "valueQuantity.unit"),
+        }
+    )
+
+    df_chg = pd.DataFrame(
+        {
+            "chargeitem_id": column(chg, "id"),
+            "patient_id": ref_ids(column(chg, "subject.reference")),
+            "encounter_id": ref_ids(column(chg, "context.reference")),
+            "cpt_system": first_item(chg, "code.coding", "system"),
+            "cpt_code": first_item(chg, "code.coding", "code"),
+            "cpt_display": first_item(chg, "code.coding", "display").fillna(column(chg, "code.text")),
+            "occurrence_ts": column(chg, "occurrenceDateTime"),
+            "quantity": column(chg, "quantity.value"),
+            "amount": column(chg, "priceOverride.value"),
+            "currency": column(chg, "priceOverride.currency"),
+        }
+    )
 
     return df_pat, df_enc, df_obs, df_chg
+
+
+def ingest_one_file(path: Path) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Parse one bundle file into the four staging frames, tagged with source_file.
+    Top-level so it can be shipped to a ProcessPoolExecutor worker.
+    """
+    frames = ingest_bundle(load_json(path))
+    for df in frames:
+        df["source_file"] = path.name
+    return frames
  
 
 def main() -> None:
-    load_dotenv()
-    db_url = os.getenv("DATABASE_URL")
-    if not db_url:
-        die("DATABASE_URL not set (.env missing?)")
-
-    engine = create_engine(db_url, future=True)
+    engine = get_engine()
 
     if not FHIR_DIR.exists():
         die(f"Missing folder: {FHIR_DIR}. Create it and add sample_bundle.json") 
@@ -215,20 +199,15 @@ def main() -> None:
     if not files:
         die(f"No .json files found in {FHIR_DIR}")
 
-    # Combine all bundles into one staging load
-    all_pat, all_enc, all_obs, all_chg = [], [], [], [] 
-    for fp in files:
-        bundle = load_json(fp)
-        df_pat, df_enc, df_obs, df_chg = ingest_bundle(bundle)
-        df_pat["source_file"] = fp.name
-        df_enc["source_file"] = fp.name 
-        df_obs["source_file"] = fp.name
-        df_chg["source_file"] = fp.name
-
-        all_pat.append(df_pat) 
-        all_enc.append(df_enc)
-        all_obs.append(df_obs)
-        all_chg.append(df_chg)
+    # Combine all bundles into one staging load. JSON parsing is CPU-bound and
+    # holds the GIL, so bundles are parsed in separate processes (a single file
+    # is parsed in-process to skip the pool start-up cost).
+    if len(files) > 1:
+        with ProcessPoolExecutor() as ex:
+            results = list(ex.map(ingest_one_file, files))
+    else:
+        results = [ingest_one_file(files[0])]
+    all_pat, all_enc, all_obs, all_chg = (list(frames) for frames in zip(*results))
 
     stg_pat = pd.concat(all_pat, ignore_index=True) if all_pat else pd.DataFrame()
     stg_enc = pd.concat(all_enc, ignore_index=True) if all_enc else pd.DataFrame()
@@ -243,14 +222,23 @@ def main() -> None:
     # Observation/ChargeItem can be empty in some feeds; we allow it. 
 
     # Write staging tables
+    # etl_run_log is created by create_schema.py (run once during setup)
     with engine.begin() as conn:
-        conn.execute(text("CREATE TABLE IF NOT EXISTS etl_run_log (run_id BIGSERIAL PRIMARY KEY, started_at TIMESTAMPTZ NOT NULL DEFAULT now(), finished_at TIMESTAMPTZ, status TEXT NOT NULL DEFAULT 'running', notes TEXT);"))
         run_id = conn.execute(text("INSERT INTO etl_run_log(status, notes) VALUES ('running', 'ingest fhir bundle(s)') RETURNING run_id;")).scalar_one()
 
-    stg_pat.to_sql("stg_fhir_patient", engine, if_exists="replace", index=False, method="multi", chunksize=5000)
-    stg_enc.to_sql("stg_fhir_encounter", engine, if_exists="replace", index=False, method="multi", chunksize=5000)
-    stg_obs.to_sql("stg_fhir_observation", engine, if_exists="replace", index=False, method="multi", chunksize=5000) 
-    stg_chg.to_sql("stg_fhir_chargeitem", engine, if_exists="replace", index=False, method="multi", chunksize=5000)
+    # Rebuild and load all four staging tables in one transaction (a failed load
+    # leaves the previous staging data in place)
+    staged = {
+        "stg_fhir_patient": stg_pat,
+        "stg_fhir_encounter": stg_enc,
+        "stg_fhir_observation": stg_obs,
+        "stg_fhir_chargeitem": stg_chg,
+    }
+    with engine.begin() as conn:
+        for table, df in staged.items():
+            conn.execute(text(f"DROP TABLE IF EXISTS {table};"))
+            conn.execute(text(f"CREATE UNLOGGED TABLE {table} ({FHIR_STAGING_COLUMNS[table]});"))
+            copy_from_df(conn, table, df)
 
     with engine.begin() as conn:
         conn.execute(
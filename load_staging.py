@@ -1,11 +1,13 @@
 from __future__ import annotations
 
-import os
+import csv
 from pathlib import Path
 
-import pandas as pd 
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
+import adbc_driver_postgresql.dbapi as adbc
+import pyarrow.parquet as pq
+from sqlalchemy import text
+
+from etl_common import get_engine, libpq_url
 
 
 RAW_DIR = Path("data/raw")
@@ -18,60 +20,114 @@ FILES = {
     "stg_staff": "staff.csv", 
 }
 
+# Staging column types (columns are matched by name, so order doesn't matter).
+# Tables are created UNLOGGED: they are rebuilt on every run, so skipping WAL is safe.
+# Numeric types match what pyarrow writes to Parquet (int64 / float64), which ADBC requires.
+STAGING_COLUMNS = {
+    "stg_patients": "patient_id TEXT, birth_year BIGINT, sex TEXT",
+    "stg_encounters": (
+        "encounter_id TEXT, patient_id TEXT, provider_id TEXT, department_id TEXT, "
+        "admit_ts TIMESTAMPTZ, discharge_ts TIMESTAMPTZ, encounter_type TEXT"
+    ),
+    "stg_charges": "charge_id TEXT, encounter_id TEXT, cpt_code TEXT, amount_cents BIGINT, posted_ts TIMESTAMPTZ",
+    "stg_labs": (
+        "lab_id TEXT, encounter_id TEXT, loinc_code TEXT, result_value DOUBLE PRECISION, unit TEXT, "
+        "result_ts TIMESTAMPTZ"
+    ),
+    "stg_staff": "staff_id TEXT, provider_id TEXT, role TEXT, hire_date DATE",
+}
+
 
 def require_file(path: Path) -> None:
     if not path.exists():
         raise FileNotFoundError(f"Missing file: {path}. Run generate_raw_data.py first.")
 
 
-def main() -> None:
-    load_dotenv()
-    db_url = os.getenv("DATABASE_URL")
-    if not db_url:
-        raise RuntimeError("DATABASE_URL not found. Ensure you have a .env file with DATABASE_URL=...")
+def copy_csv(cur, table: str, path: Path) -> int:
+    """
+    Stream a raw CSV extract straight into `table` with COPY ... FROM STDIN.
+    The header row is lowercased and used as the COPY column list; the rest of
+    the file is handed to the server unparsed. Returns the number of rows loaded.
+    """
+    with path.open("rb") as f:
+        header = f.readline().decode("utf-8-sig")
+        columns = ", ".join(f'"{c.strip().lower()}"' for c in next(csv.reader([header])))
+        cur.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH CSV", f)
+    return cur.rowcount
+
+
+def parquet_path(fname: str) -> Path:
+    return (RAW_DIR / fname).with_suffix(".parquet")
+
+
+def parquet_is_current(fname: str) -> bool:
+    """
+    True when the Parquet sibling exists and the CSV is absent or not newer.
+    A CSV replaced after generate_raw_data.py ran (e.g. a real extract) makes
+    its Parquet copy stale, so the CSVs are loaded instead.
+    """
+    pq_file, csv_file = parquet_path(fname), RAW_DIR / fname
+    if not pq_file.exists():
+        return False
+    return not csv_file.exists() or csv_file.stat().st_mtime <= pq_file.stat().st_mtime
+
+
+def load_parquet() -> int:
+    """
+    Load the Parquet siblings written by generate_raw_data.py through ADBC,
+    which ingests Arrow tables with binary COPY (no CSV parsing, no pandas).
+    """
+    total_rows = 0
+    with adbc.connect(libpq_url()) as conn, conn.cursor() as cur:
+        for table, fname in FILES.items():
+            cur.execute(f"DROP TABLE IF EXISTS {table};")
+            cur.execute(f"CREATE UNLOGGED TABLE {table} ({STAGING_COLUMNS[table]});")
+
+            data = pq.read_table(parquet_path(fname))
+            data = data.rename_columns([c.strip().lower() for c in data.column_names])
+            rows = cur.adbc_ingest(table, data, mode="append")
+            print(f"Loaded {table}: {rows:,} rows (parquet)")
+            total_rows += rows
+        conn.commit()
+    return total_rows
+
+
+def load_csv(engine) -> int:
+    """Load the raw CSV extracts with COPY (used unless every Parquet sibling is current)."""
+    total_rows = 0
+    with engine.begin() as conn:
+        with conn.connection.cursor() as cur:
+            for table, fname in FILES.items():
+                conn.execute(text(f"DROP TABLE IF EXISTS {table};"))
+                conn.execute(text(f"CREATE UNLOGGED TABLE {table} ({STAGING_COLUMNS[table]});"))
+
+                rows = copy_csv(cur, table, RAW_DIR / fname)
+                print(f"Loaded {table}: {rows:,} rows") 
+                total_rows += rows
+    return total_rows
 
-    engine = create_engine(db_url, future=True)
+
+def main() -> None:
+    engine = get_engine()
  
-    # Basic guardrails
-    for fname in FILES.values(): 
-        require_file(RAW_DIR / fname)
+    # Basic guardrails (the CSVs are only needed when they are what gets loaded)
+    use_parquet = all(parquet_is_current(fname) for fname in FILES.values())
+    if not use_parquet:
+        for fname in FILES.values():
+            require_file(RAW_DIR / fname)
 
+    # etl_run_log is created by create_schema.py (run once during setup)
     with engine.begin() as conn:
-        # Ensure staging schema exists (we'll use public schema but keep names stg_*) 
-        conn.execute(
-            text(
-                """
-                CREATE TABLE IF NOT EXISTS etl_run_log ( 
-                  run_id BIGSERIAL PRIMARY KEY,
-                  started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-                  finished_at TIMESTAMPTZ,
-                  status TEXT NOT NULL DEFAULT 'running', 
-                  notes TEXT
-                ); 
-                """
-            )
-        ) 
-
         run_id = conn.execute(
             text("INSERT INTO etl_run_log(status, notes) VALUES ('running', 'load staging') RETURNING run_id;")
         ).scalar_one() 
 
-        # Drop staging tables if they exist (safe re-run)
-        for table in FILES.keys(): 
-            conn.execute(text(f"DROP TABLE IF EXISTS {table};"))
-
-    # Load each CSV into Postgres as staging table 
-    total_rows = 0 
-    for table, fname in FILES.items():
-        df = pd.read_csv(RAW_DIR / fname)
-  
-        # Light cleanup: standardize column names to lowercase
-        df.columns = [c.strip().lower() for c in df.columns]
-
-        # Write to Postgres
-        df.to_sql(table, engine, if_exists="replace", index=False, method="multi", chunksize=5000)
-        print(f"Loaded {table}: {len(df):,} rows") 
-        total_rows += len(df)
+    # Rebuild and load each staging table in one transaction (safe re-run;
+    # a failed load leaves the previous staging data in place)
+    if use_parquet:
+        total_rows = load_parquet()
+    else:
+        total_rows = load_csv(engine)
 
     with engine.begin() as conn:
         conn.execute( 
@@ -1,5 +1,16 @@
+-- Reporting views are materialized: the warehouse only changes when
+-- validate_and_build.py runs, and it refreshes them at the end of each build.
+-- Each one needs a unique index so it can be refreshed CONCURRENTLY.
+-- They are dropped and recreated so re-running create_views.py applies edits.
+
+-- Replaced by the materialized versions below
+DROP VIEW IF EXISTS public.vw_avg_los_by_encounter_type;
+DROP VIEW IF EXISTS public.vw_encounters_by_department_month;
+
+
 -- Average length of stay by encounter type  
-CREATE OR REPLACE VIEW public.vw_avg_los_by_encounter_type AS
+DROP MATERIALIZED VIEW IF EXISTS public.mv_avg_los_by_encounter_type;
+CREATE MATERIALIZED VIEW public.mv_avg_los_by_encounter_type AS
 SELECT
     encounter_type,
     AVG(length_of_stay_days) AS avg_length_of_stay_days,
@@ -8,9 +19,13 @@ FROM public.fact_encounter
 GROUP BY encounter_type
 ORDER BY encounter_type;
 
+CREATE UNIQUE INDEX ux_mv_avg_los_by_encounter_type
+    ON public.mv_avg_los_by_encounter_type (encounter_type);
 
--- Monthly encounters and charges by department`
-CREATE OR REPLACE VIEW public.vw_encounters_by_department_month AS
+
+-- Monthly encounters and charges by department
+DROP MATERIALIZED VIEW IF EXISTS public.mv_encounters_by_department_month;
+CREATE MATERIALIZED VIEW public.mv_encounters_by_department_month AS
 SELECT
     department_id,
     DATE_TRUNC('month', admit_date) AS month,
@@ -19,3 +34,6 @@ SELECT
 FROM public.fact_encounter
 GROUP BY department_id, DATE_TRUNC('month', admit_date)
 ORDER BY month, department_id;
+
+CREATE UNIQUE INDEX ux_mv_encounters_by_department_month
+    ON public.mv_encounters_by_department_month (department_id, month);
@@ -1,12 +1,126 @@
 from __future__ import annotations
 
-import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import numpy as np
 import pandas as pd
 import argparse
 
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
+
+from etl_common import copy_from_df, get_engine, read_sql
+
+
+# ----------------------------
+# CSV staging already uses warehouse column names, so validation and the
+# dimension/fact build run server-side without pulling rows into pandas.
+# Each check returns a row only when the rule is violated.
+# ----------------------------
+CSV_CHECKS = [
+    (
+        "SELECT 1 FROM stg_patients GROUP BY patient_id HAVING COUNT(*) > 1 LIMIT 1",
+        "Duplicate patient_id in stg_patients",
+    ),
+    (
+        "SELECT 1 FROM stg_encounters GROUP BY encounter_id HAVING COUNT(*) > 1 LIMIT 1",
+        "Duplicate encounter_id in stg_encounters",
+    ),
+    (
+        "SELECT 1 FROM stg_charges WHERE amount_cents < 0 LIMIT 1",
+        "Negative charge amounts detected",
+    ),
+    (
+        "SELECT 1 FROM stg_encounters WHERE discharge_ts < admit_ts LIMIT 1",
+        "Discharge before admit detected",
+    ),
+    (
+        "SELECT 1 FROM stg_charges c "
+        "WHERE NOT EXISTS (SELECT 1 FROM stg_encounters e WHERE e.encounter_id = c.encounter_id) LIMIT 1",
+        "Charges reference missing encounters",
+    ),
+    (
+        "SELECT 1 FROM stg_labs l "
+        "WHERE NOT EXISTS (SELECT 1 FROM stg_encounters e WHERE e.encounter_id = l.encounter_id) LIMIT 1",
+        "Labs reference missing encounters",
+    ),
+    (
+        "SELECT 1 FROM stg_encounters e WHERE e.patient_id IS NOT NULL "
+        "AND NOT EXISTS (SELECT 1 FROM stg_patients p WHERE p.patient_id = e.patient_id) LIMIT 1",
+        "Encounters reference missing patients",
+    ),
+]
+
+# FHIR checks that only need a yes/no from the database. Observations are not
+# used by the build otherwise, so they are never read into pandas; the other
+# FHIR rules run in build_fhir_tables on the normalized frames.
+FHIR_CHECKS = [
+    (
+        "SELECT 1 FROM stg_fhir_observation o "
+        "WHERE NOT EXISTS (SELECT 1 FROM stg_fhir_encounter e WHERE e.encounter_id = o.encounter_id) LIMIT 1",
+        "Labs reference missing encounters",
+    ),
+]
+
+# Dimensions first, fact last (order matters with FKs). Dates are taken in UTC
+# so they match what the pandas build produces from tz-aware timestamps.
+CSV_BUILD_SQL = [
+    """
+    INSERT INTO dim_department (department_id, department_name)
+    SELECT DISTINCT department_id, department_id
+    FROM stg_encounters
+    """,
+    """
+    INSERT INTO dim_provider (provider_id, provider_name, department_id)
+    SELECT DISTINCT provider_id, provider_id, department_id
+    FROM stg_encounters
+    """,
+    """
+    INSERT INTO dim_patient (patient_id, birth_year, sex)
+    SELECT DISTINCT patient_id, birth_year, sex
+    FROM stg_patients
+    """,
+    """
+    INSERT INTO dim_time (date_key, year, month, day, dow)
+    SELECT d, EXTRACT(year FROM d), EXTRACT(month FROM d), EXTRACT(day FROM d), EXTRACT(isodow FROM d) - 1
+    FROM (
+        -- every calendar day from the earliest to the latest encounter timestamp
+        SELECT generate_series(
+            (LEAST(MIN(admit_ts), MIN(discharge_ts)) AT TIME ZONE 'UTC')::date,
+            (GREATEST(MAX(admit_ts), MAX(discharge_ts)) AT TIME ZONE 'UTC')::date,
+            interval '1 day'
+        )::date AS d
+        FROM stg_encounters
+    ) dates
+    """,
+    """
+    INSERT INTO fact_encounter (
+        encounter_id, patient_id, provider_id, department_id, admit_date, discharge_date,
+        encounter_type, length_of_stay_days, total_charges
+    )
+    SELECT
+        e.encounter_id,
+        e.patient_id,
+        e.provider_id,
+        e.department_id,
+        (e.admit_ts AT TIME ZONE 'UTC')::date,
+        (e.discharge_ts AT TIME ZONE 'UTC')::date,
+        e.encounter_type,
+        ROUND(EXTRACT(epoch FROM e.discharge_ts - e.admit_ts) / 86400, 2),
+        COALESCE(c.total_charges, 0)
+    FROM stg_encounters e
+    LEFT JOIN (
+        SELECT encounter_id, ROUND(SUM(amount_cents) / 100.0, 2) AS total_charges
+        FROM stg_charges
+        GROUP BY encounter_id
+    ) c USING (encounter_id)
+    """,
+]
+
+# Reporting views from sql/views.sql, refreshed after each build
+REPORT_VIEWS = [
+    "public.mv_avg_los_by_encounter_type",
+    "public.mv_encounters_by_department_month",
+]
 
 
 def fail(msg: str):
@@ -23,125 +137,121 @@ def parse_args():
     return parser.parse_args()
 
 
-def main():
+def validate_staging(conn, checks) -> None:
+    for sql, msg in checks:
+        if conn.execute(text(sql)).first() is not None:
+            fail(msg)
 
-    # Args for CSV or FHIR (just the one flag)
-    args = parse_args()
-    source = args.source
 
-    load_dotenv()
-    engine = create_engine(os.getenv("DATABASE_URL"), future=True)
+def year_of(birth_dates: pd.Series) -> pd.Series:
+    """
+    FHIR birthDate is ISO 8601 ("1987", "1987-04" or "1987-04-12"), so the year
+    is always the first four characters; no need to run the datetime parser.
+    """
+    return pd.to_numeric(birth_dates.str.slice(0, 4), errors="coerce").astype("Int64")
 
-    with engine.begin() as conn:
-        run_id = conn.execute(
-            text(
-                "INSERT INTO etl_run_log(status, notes) "
-                "VALUES ('running', 'validate + build warehouse') "
-                "RETURNING run_id"
-            )
-        ).scalar_one()
 
-    # ----------------------------
-    # Load staging tables depending on arg
-    # ----------------------------
-    if source == "csv":
-        patients = pd.read_sql("SELECT * FROM stg_patients", engine)
-        encounters = pd.read_sql("SELECT * FROM stg_encounters", engine)
-        charges = pd.read_sql("SELECT * FROM stg_charges", engine)
-        labs = pd.read_sql("SELECT * FROM stg_labs", engine)
-        staff = pd.read_sql("SELECT * FROM stg_staff", engine)
-
-    elif source == "fhir":
-        patients = pd.read_sql("SELECT * FROM stg_fhir_patient", engine)
-        encounters = pd.read_sql("SELECT * FROM stg_fhir_encounter", engine)
-        charges = pd.read_sql("SELECT * FROM stg_fhir_chargeitem", engine)
-        labs = pd.read_sql("SELECT * FROM stg_fhir_observation", engine)
-        staff = pd.DataFrame()  # FHIR bundle doesn't include HR data
-
-    #----------------------------
-    # If FHIR arg then we need to normalize tables so we have expected values/names
-    #----------------------------
-    if source == "fhir":
-        # Normalize FHIR patients
-        patients = patients.rename(
-            columns={
-                "birth_date": "birth_year",
-                "gender": "sex",
-            }
-        )
-
-        patients["birth_year"] = (
-            pd.to_datetime(patients["birth_year"], errors="coerce").dt.year
-        )
-
-        # Standardize sex values to match CSV conventions
-        patients["sex"] = patients["sex"].map(
-            {
-                "male": "M",
-                "female": "F",
-                "other": "O",
-                "unknown": None,
-            }
-        )
-
-        # Normalize encounters
-        encounters = encounters.rename(
-            columns={
-                "start_ts": "admit_ts",
-                "end_ts": "discharge_ts",
-                "department": "department_id",
-            }
-        )
+def sex_codes(genders: pd.Series) -> pd.Series:
+    """
+    Standardize FHIR gender codes to the CSV conventions (M/F/O). The cast maps
+    anything outside the FHIR codes to NaN; the renames then only touch the four
+    categories, not every row ("unknown" is dropped, so it becomes NULL).
+    """
+    sex = genders.astype(pd.CategoricalDtype(["male", "female", "other", "unknown"]))
+    return (
+        sex.cat.rename_categories({"male": "M", "female": "F", "other": "O"})
+        .cat.remove_categories("unknown")
+    )
 
-        # Normalize charges
-        charges = charges.rename(
-            columns={
-                "amount": "amount"
-            }
-        )
 
-        # Normalize labs
-        labs = labs.rename(
-            columns={
-                "loinc_code": "loinc_code",
-                "effective_ts": "result_ts",
-                "value": "result_value",
-            }
-        )
+def as_utc(ts: pd.Series) -> pd.Series:
+    """
+    Timestamps as tz-aware UTC. FHIR staging stores them as TEXT, but a column
+    that already arrives as datetime64 skips the string parser.
+    """
+    if not pd.api.types.is_datetime64_any_dtype(ts):
+        # ISO8601 rather than a format inferred from the first value: FHIR
+        # dateTimes mix shapes (Z vs offsets, fractional seconds, date-only)
+        return pd.to_datetime(ts, utc=True, format="ISO8601")
+    if ts.dt.tz is None:
+        return ts.dt.tz_localize("UTC")
+    return ts
+
+
+def build_fhir_tables() -> dict[str, pd.DataFrame]:
+    """
+    Read FHIR staging, normalize it to the CSV conventions, validate it and
+    build the warehouse frames. Returned in load order (dimensions, then fact).
+    """
+    # The reads are independent and connectorx releases the GIL while it
+    # fetches, so run them side by side (each opens its own connection).
+    # Only the columns the build uses are read.
+    queries = [
+        "SELECT patient_id, birth_date, gender FROM stg_fhir_patient",
+        "SELECT encounter_id, patient_id, start_ts, end_ts, department, provider_name, "
+        "class_display, class_code FROM stg_fhir_encounter",
+        "SELECT encounter_id, amount FROM stg_fhir_chargeitem",
+    ]
+    with ThreadPoolExecutor(max_workers=len(queries)) as ex:
+        patients, encounters, charges = ex.map(read_sql, queries)
 
-        # provider_id doesn't exist in our FHIR staging; create a stable surrogate
-        if "provider_id" not in encounters.columns:
-            encounters["provider_id"] = encounters.get("provider_name")
+    #----------------------------
+    # Normalize tables so we have expected values/names
+    #----------------------------
+    # Each normalized frame is built in one DataFrame(...) call instead of a
+    # chain of renames and column assignments
+    patients = pd.DataFrame(
+        {
+            "patient_id": patients["patient_id"],
+            "birth_year": year_of(patients["birth_date"]),
+            "sex": sex_codes(patients["gender"]),
+        }
+    )
 
-        # encounter_type in CSV exists; for FHIR, use class_display (or class_code)
-        if "encounter_type" not in encounters.columns:
-            encounters["encounter_type"] = encounters.get("class_display").fillna(encounters.get("class_code"))
+    # provider_id doesn't exist in our FHIR staging; provider_name is a stable surrogate.
+    # encounter_type in CSV exists; for FHIR, use class_display (or class_code)
+    encounters = pd.DataFrame(
+        {
+            "encounter_id": encounters["encounter_id"],
+            "patient_id": encounters["patient_id"],
+            "provider_id": encounters["provider_name"],
+            "department_id": encounters["department"],
+            "admit_ts": as_utc(encounters["start_ts"]),
+            "discharge_ts": as_utc(encounters["end_ts"]),
+            "encounter_type": encounters["class_display"].fillna(encounters["class_code"]),
+        }
+    )
 
     # ----------------------------
     # VALIDATION 
     # ----------------------------
-    if patients["patient_id"].duplicated().any():
-        fail("Duplicate patient_id in stg_patients")
+    if not patients["patient_id"].is_unique:
+        fail("Duplicate patient_id in stg_fhir_patient")
 
-    if encounters["encounter_id"].duplicated().any(): 
-        fail("Duplicate encounter_id in stg_encounters")
+    if not encounters["encounter_id"].is_unique: 
+        fail("Duplicate encounter_id in stg_fhir_encounter")
 
-    if not charges.empty and (charges["amount"] < 0).any():
+    # Series.min() is one reduction with no boolean mask; it skips NaN and is
+    # NaN itself for an empty frame, which compares False
+    if charges["amount"].min() < 0:
         fail("Negative charge amounts detected")
 
-    encounters["admit_ts"] = pd.to_datetime(encounters["admit_ts"])
-    encounters["discharge_ts"] = pd.to_datetime(encounters["discharge_ts"]) 
-
-    if (encounters["discharge_ts"] < encounters["admit_ts"]).any():
+    # Compare the raw UTC datetime64 arrays (NaT compares False, so an open
+    # encounter isn't flagged); the arrays are reused for length of stay below.
+    # The unit is pinned because parsed timestamps may be [us] rather than [ns].
+    admit = encounters["admit_ts"].to_numpy("datetime64[ns]")
+    discharge = encounters["discharge_ts"].to_numpy("datetime64[ns]")
+    if np.any(discharge < admit):
         fail("Discharge before admit detected")
 
-    # Foreign key checks 
-    enc_ids = set(encounters["encounter_id"])
-    if not set(charges["encounter_id"]).issubset(enc_ids):
+    # Foreign key checks (hash probes against the raw key arrays, no Python sets)
+    enc_ids = pd.Index(encounters["encounter_id"].to_numpy())
+    if not charges["encounter_id"].isin(enc_ids).all():
         fail("Charges reference missing encounters")
 
-    if not set(labs["encounter_id"]).issubset(enc_ids):
-        fail("Labs reference missing encounters") 
+    pat_ids = pd.Index(patients["patient_id"].to_numpy())
+    if not encounters["patient_id"].dropna().isin(pat_ids).all():
+        fail("Encounters reference missing patients")
 
     # ----------------------------
     # DIMENSIONS
@@ -151,92 +261,132 @@ def main():
     dim_department = encounters[["department_id"]].drop_duplicates() 
     dim_department["department_name"] = dim_department["department_id"]
 
-    dim_provider = encounters[["provider_id", "department_id"]].drop_duplicates()
+    # Dedupe the (provider, department) pairs on categorical codes, so the pair
+    # hash runs over ints instead of strings; back to plain strings for the load
+    dim_provider = (
+        encounters[["provider_id", "department_id"]].astype("category").drop_duplicates().astype(object)
+    )
     dim_provider["provider_name"] = dim_provider["provider_id"] 
 
-    # Time dimension
-    all_dates = pd.concat( 
-        [
-            encounters["admit_ts"].dt.date,
-            encounters["discharge_ts"].dt.date, 
-        ]
-    ).drop_duplicates()
- 
-    dim_time = pd.DataFrame({"date_key": all_dates}) 
-    dim_time["year"] = dim_time["date_key"].apply(lambda d: d.year)
-    dim_time["month"] = dim_time["date_key"].apply(lambda d: d.month) 
-    dim_time["day"] = dim_time["date_key"].apply(lambda d: d.day)
-    dim_time["dow"] = dim_time["date_key"].apply(lambda d: d.weekday()) 
+    # Time dimension: every UTC calendar day from the earliest to the latest
+    # encounter timestamp (same calendar as the CSV build's generate_series)
+    enc_ts = encounters[["admit_ts", "discharge_ts"]]
+    first_day = enc_ts.min().min().tz_localize(None).normalize()
+    last_day = enc_ts.max().max().tz_localize(None).normalize()
+    days = pd.date_range(first_day, last_day, freq="D")
+
+    dim_time = pd.DataFrame(
+        {
+            "date_key": days,
+            "year": days.year,
+            "month": days.month,
+            "day": days.day,
+            "dow": days.weekday,
+        }
+    )
 
     # ----------------------------
     # FACT: encounters
     # ----------------------------
-    charges_agg = (
-        charges.groupby("encounter_id", as_index=False)["amount"]
-        .sum()
-        .rename(columns={"amount": "total_charges"})
-    )
-
-    fact = encounters.merge(charges_agg, on="encounter_id", how="left")
-    fact["total_charges"] = fact["total_charges"].fillna(0)
-
-    fact["length_of_stay_days"] = (
-        (fact["discharge_ts"] - fact["admit_ts"]).dt.total_seconds() / 86400
-    ).round(2)
-
-    fact = fact[
+    # Group on categorical codes (int keys instead of string hashing); output
+    # order doesn't matter because the totals are looked up by key
+    enc_keys = charges["encounter_id"].astype("category")
+    totals = charges["amount"].groupby(enc_keys, sort=False, observed=True).sum()
+
+    # One row per encounter_id in totals, so a map lookup replaces a wide merge
+    fact = encounters.assign(total_charges=encounters["encounter_id"].map(totals).fillna(0))
+
+    # Plain datetime64 subtraction on the UTC arrays from validation (fact rows
+    # line up with encounters); NaT propagates as NaN
+    los_days = ((discharge - admit) / np.timedelta64(1, "D")).round(2)
+    # The column is INT and COPY won't cast "2.35", so round the way Postgres
+    # casts NUMERIC to INT (half away from zero; LOS is never negative here)
+    fact["length_of_stay_days"] = pd.array(np.floor(los_days + 0.5), dtype="Int64")
+
+    # Convert timestamps to UTC calendar days to match schema (date_key); normalize()
+    # keeps datetime64 instead of boxing a Python date per row like .dt.date.
+    # Built by column selection (no full copy of fact just to add two columns).
+    fact_out = fact[
         [
             "encounter_id",
             "patient_id",
             "provider_id",
             "department_id",
-            "admit_ts",
-            "discharge_ts",
             "encounter_type",
             "length_of_stay_days",
             "total_charges",
         ]
-    ]
+    ].assign(
+        admit_date=fact["admit_ts"].dt.tz_localize(None).dt.normalize(),
+        discharge_date=fact["discharge_ts"].dt.tz_localize(None).dt.normalize(),
+    )
+
+    return {
+        "dim_department": dim_department,
+        "dim_provider": dim_provider,
+        "dim_patient": dim_patient,
+        "dim_time": dim_time,
+        "fact_encounter": fact_out,
+    }
+
+
+def main():
+
+    # Args for CSV or FHIR (just the one flag)
+    args = parse_args()
+    source = args.source
+
+    engine = get_engine()
+
+    with engine.begin() as conn:
+        run_id = conn.execute(
+            text(
+                "INSERT INTO etl_run_log(status, notes) "
+                "VALUES ('running', 'validate + build warehouse') "
+                "RETURNING run_id"
+            )
+        ).scalar_one()
+
+    # FHIR staging needs Python-side normalization before it matches the
+    # warehouse model; CSV staging is validated and built in SQL below
+    if source == "fhir":
+        fhir_tables = build_fhir_tables()
 
     # ----------------------------
     # LOAD WAREHOUSE (preserve FKs)
     # ----------------------------
     with engine.begin() as conn:
-        # Clear fact first, then dimensions (order matters with FKs)
-        conn.execute(text("TRUNCATE TABLE fact_encounter;"))
-
-        conn.execute(text("TRUNCATE TABLE dim_time CASCADE;"))
-        conn.execute(text("TRUNCATE TABLE dim_provider CASCADE;"))
-        conn.execute(text("TRUNCATE TABLE dim_department CASCADE;"))
-        conn.execute(text("TRUNCATE TABLE dim_patient CASCADE;"))
-
-        # Re-load dims (append keeps table + constraints)
-        dim_department.to_sql("dim_department", conn, if_exists="append", index=False, method="multi")
-        dim_provider.to_sql("dim_provider", conn, if_exists="append", index=False, method="multi")
-        dim_patient.to_sql("dim_patient", conn, if_exists="append", index=False, method="multi")
-        dim_time.to_sql("dim_time", conn, if_exists="append", index=False, method="multi")
-
-        # Load fact last
-        # Convert timestamps to dates to match schema (date_key)
-        fact_out = fact.copy()
-        fact_out["admit_date"] = fact_out["admit_ts"].dt.date
-        fact_out["discharge_date"] = fact_out["discharge_ts"].dt.date
-
-        fact_out = fact_out[
-            [
-                "encounter_id",
-                "patient_id",
-                "provider_id",
-                "department_id",
-                "admit_date",
-                "discharge_date",
-                "encounter_type",
-                "length_of_stay_days",
-                "total_charges",
-            ]
-        ]
+        validate_staging(conn, CSV_CHECKS if source == "csv" else FHIR_CHECKS)
+
+        # The checks above already guarantee referential integrity, so skip the
+        # per-row FK triggers during the reload. SET LOCAL reverts at commit;
+        # the constraints themselves stay defined on the tables.
+        conn.execute(text("SET LOCAL session_replication_role = replica;"))
+
+        # The warehouse is rebuilt from staging on every run, so losing the last
+        # commit in a server crash only means re-running this script; don't
+        # wait for the WAL flush at commit
+        conn.execute(text("SET LOCAL synchronous_commit = off;"))
+
+        # Clear fact and dimensions together (one statement, so FK order doesn't matter)
+        conn.execute(
+            text("TRUNCATE TABLE fact_encounter, dim_time, dim_provider, dim_department, dim_patient CASCADE;")
+        )
+
+        if source == "csv":
+            for sql in CSV_BUILD_SQL:
+                conn.execute(text(sql))
+        else:
+            # Re-load dims then fact with COPY (tables + constraints stay in place)
+            for table, df in fhir_tables.items():
+                copy_from_df(conn, table, df)
+
+        conn.execute(text("SET LOCAL session_replication_role = origin;"))
 
-        fact_out.to_sql("fact_encounter", conn, if_exists="append", index=False, method="multi")
+        # Refresh reporting views (created by create_views.py; may not exist yet on a first run)
+        for view in REPORT_VIEWS:
+            if conn.execute(text("SELECT to_regclass(:view)"), {"view": view}).scalar() is not None:
+                conn.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view};"))
 
         conn.execute(
             text(